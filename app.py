@@ -1,23 +1,58 @@
-from flask import Flask, request, render_template, redirect, url_for
+import quart_flask_patch  # noqa: F401 - must be imported before any Flask extension
+import quart_flask_patch.app
+from quart import Quart, Response, abort, g, request, render_template, redirect, send_file, url_for
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
+from quart.datastructures import FileStorage
+from werkzeug.datastructures import MultiDict
+from werkzeug.exceptions import BadRequest, HTTPException, RequestEntityTooLarge
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
+from sqlalchemy import bindparam, event, select, text
+from sqlalchemy.orm import deferred
 import openai
+import httpx
+from aiolimiter import AsyncLimiter
+from cachetools import TTLCache
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_random_exponential
+from redisvl.extensions.cache.llm import SemanticCache
+from redisvl.utils.vectorize import HFTextVectorizer
 from twilio.twiml.messaging_response import MessagingResponse
+import io
 import os
+import csv
+import json
+import hashlib
+import mimetypes
+import re
+import tempfile
+import asyncio
 import logging
-from werkzeug.utils import secure_filename
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
 
 
 
-# Initialize the Flask app
-app = Flask(__name__)
+# quart_flask_patch reads every request body into memory before dispatch so synchronous Flask code can use
+# request.data. Nothing here does (views await request.form), so restore Quart's dispatch and let uploads stream.
+Quart.full_dispatch_request = quart_flask_patch.app.old_full_dispatch_request
+
+# Initialize the Quart app (async, served by an ASGI server such as hypercorn)
+app = Quart(__name__)
 
 # Configure the database URI and disable modification tracking
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///training_data.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-# Initialize SQLAlchemy with the Flask app
-db = SQLAlchemy(app)
+# Connections are used from worker threads (asyncio.to_thread); wait on locks instead of failing fast
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+    'pool_pre_ping': True,
+    # Room for the compiled forms of the module-level search statements and the ORM's own queries
+    'query_cache_size': 1200,
+    'connect_args': {'check_same_thread': False, 'timeout': 30},
+}
+
+# Initialize SQLAlchemy with the Flask app. Reads (the /chatgpt hot path) skip the autoflush before each
+# query, and committed objects stay loaded instead of being re-read from SQLite on the next attribute access.
+db = SQLAlchemy(app, session_options={'autoflush': False, 'expire_on_commit': False})
 
 # Initialize Flask-Migrate with the Flask app and SQLAlchemy db
 migrate = Migrate(app, db)
@@ -25,14 +60,51 @@ migrate = Migrate(app, db)
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 
-# Initialize the OpenAI API key from environment variables
-openai.api_key = os.environ.get("OPENAI_API_KEY")
+# Shared async OpenAI client, created when the server starts
+client = None
+
+# Connection pool of the OpenAI client: keep TLS connections to api.openai.com alive between requests
+OPENAI_CONNECTION_LIMITS = httpx.Limits(max_connections=256, max_keepalive_connections=64, keepalive_expiry=60)
+# Per-attempt timeout of OpenAI calls. The SDK default is 600 s, and a hung call would hold one of the
+# OPENAI_MAX_CONCURRENCY slots long after Twilio (15 s webhook timeout) has given up on the reply.
+OPENAI_TIMEOUT = httpx.Timeout(20, connect=5)
+
+# Threads for blocking work (SQLite, embeddings) awaited via asyncio.to_thread, so the event loop
+# keeps serving other webhooks meanwhile
+BLOCKING_IO_WORKERS = 32
+
+# In-process cache of recent answers keyed by the normalized message, checked before SQLite.
+# Cleared whenever training data changes, since a write can change the answer to any message.
+answer_cache = TTLCache(maxsize=10_000, ttl=300)
+# Bumped by invalidate_answer_cache; /chatgpt only caches an answer if no write happened while it looked it up
+answer_cache_generation = 0
+
+# Drop every cached answer after a write to the training data
+def invalidate_answer_cache():
+    global answer_cache_generation
+    answer_cache_generation += 1
+    answer_cache.clear()
+
+# Reply sent when an answer could not be generated
+FALLBACK_ANSWER = "I'm sorry, I couldn't process your request."
+
+# Bound in-flight OpenAI calls and smooth bursts to stay under the account's rate limits
+OPENAI_MAX_CONCURRENCY = 32
+OPENAI_REQUESTS_PER_MINUTE = 500
+openai_semaphore = asyncio.Semaphore(OPENAI_MAX_CONCURRENCY)
+openai_limiter = AsyncLimiter(OPENAI_REQUESTS_PER_MINUTE, 60)
+
+# Redis semantic cache for generated answers, enabled when REDIS_URL is set
+semantic_cache = None
+vectorizer = None
 
 # Directory to save uploaded files
 UPLOAD_FOLDER = 'uploads'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'pdf'}
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+# Reject request bodies larger than this (413) so uploads cannot fill the disk
+app.config['MAX_CONTENT_LENGTH'] = 32 * 1024 * 1024
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -41,10 +113,145 @@ def allowed_file(filename):
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
 
+# Uploaded file parts are written to disk in 1 MB batches as the multipart body streams in
+UPLOAD_BUFFER_SIZE = 1 << 20
+# Largest text field accepted in an upload form
+MAX_FORM_FIELD_SIZE = 500_000
+# Most parts (fields and files) accepted in an upload form, werkzeug's max_form_parts default
+MAX_FORM_PARTS = 1000
+
+# Internal nginx location aliasing UPLOAD_FOLDER, e.g. `location /protected-uploads/ { internal; alias /app/uploads/; }`.
+# When set, /media hands files to nginx with X-Accel-Redirect so their bytes never pass through Python.
+X_ACCEL_REDIRECT_PREFIX = os.environ.get("X_ACCEL_REDIRECT_PREFIX")
+MEDIA_FIELDS = ('picture', 'document')
+
+# Sink for file parts that fail validation, so their bytes are dropped instead of buffered
+class DiscardedUpload(io.BytesIO):
+    def write(self, data):
+        return len(data)
+
+# Temporary file inside UPLOAD_FOLDER that hashes an uploaded file part while it is written.
+# Blocking: opened, written and closed on worker threads via asyncio.to_thread.
+class HashingUpload:
+    def __init__(self):
+        self.file = tempfile.NamedTemporaryFile(dir=app.config['UPLOAD_FOLDER'], suffix='.part', delete=False)
+        self.name = self.file.name
+        self.sha256 = hashlib.sha256()
+
+    def write(self, data):
+        self.sha256.update(data)
+        return self.file.write(data)
+
+    def seek(self, *args):
+        return self.file.seek(*args)
+
+    def close(self):
+        self.file.close()
+
+# Parse the multipart body of /add and /edit into (form, files), like request.form and request.files.
+# Allowed file parts are streamed to HashingUpload temporary files instead of spooled and copied, and each
+# 1 MB batch is written on a worker thread so uploads never block the event loop. store_upload later renames
+# them into place; every temporary file is tracked so discard_pending_uploads removes it if it is not stored.
+# Only the first part of each MEDIA_FIELDS name gets a temporary file, so a request holds at most two open.
+async def parse_upload_form():
+    boundary = request.mimetype_params.get('boundary', '').encode('ascii')
+    if request.mimetype != 'multipart/form-data' or not boundary:
+        return await request.form, MultiDict()
+
+    g.pending_uploads = []
+    decoder = MultipartDecoder(boundary)
+    max_parts = getattr(request, 'max_form_parts', None) or MAX_FORM_PARTS
+    parts = 0
+    file_names = set()
+    fields = []
+    files = []
+    async for chunk in request_body_chunks():
+        decoder.receive_data(chunk)
+        try:
+            part_event = decoder.next_event()
+        except ValueError as e:
+            raise BadRequest(str(e))
+        while not isinstance(part_event, (Epilogue, NeedData)):
+            if isinstance(part_event, (Field, File)):
+                parts += 1
+                if parts > max_parts:
+                    raise RequestEntityTooLarge()
+            if isinstance(part_event, Field):
+                part, sink, buffer = part_event, None, bytearray()
+            elif isinstance(part_event, File):
+                part, buffer = part_event, bytearray()
+                first_media_part = part_event.name in MEDIA_FIELDS and part_event.name not in file_names
+                file_names.add(part_event.name)
+                if first_media_part and part_event.filename and allowed_file(part_event.filename):
+                    sink = await asyncio.to_thread(HashingUpload)
+                    g.pending_uploads.append(sink)
+                else:
+                    sink = DiscardedUpload()
+            elif isinstance(part_event, Data):
+                if sink is None:
+                    buffer += part_event.data
+                    if len(buffer) > MAX_FORM_FIELD_SIZE:
+                        raise RequestEntityTooLarge()
+                    if not part_event.more_data:
+                        fields.append((part.name, buffer.decode('utf-8', 'replace')))
+                elif isinstance(sink, HashingUpload):
+                    buffer += part_event.data
+                    if len(buffer) >= UPLOAD_BUFFER_SIZE or not part_event.more_data:
+                        await asyncio.to_thread(sink.write, bytes(buffer))
+                        buffer.clear()
+                if sink is not None and not part_event.more_data:
+                    files.append((part.name, FileStorage(sink, part.filename, part.name, headers=part.headers)))
+            try:
+                part_event = decoder.next_event()
+            except ValueError as e:
+                raise BadRequest(str(e))
+    return MultiDict(fields), MultiDict(files)
+
+# The request body chunks followed by None, which tells MultipartDecoder the body is complete
+async def request_body_chunks():
+    async for chunk in request.body:
+        yield chunk
+    yield None
+
+# Move a streamed upload to its content address, UPLOAD_FOLDER/ab/cd/<sha256>.<ext>, and return
+# the path. Identical files share one copy, so if the path already exists the upload is dropped.
+def store_upload(upload):
+    stream = upload.stream
+    stream.close()
+    if not isinstance(stream, HashingUpload):
+        return None
+    digest = stream.sha256.hexdigest()
+    extension = upload.filename.rsplit('.', 1)[1].lower()
+    directory = os.path.join(app.config['UPLOAD_FOLDER'], digest[:2], digest[2:4])
+    path = os.path.join(directory, f'{digest}.{extension}')
+    if os.path.exists(path):
+        os.remove(stream.name)
+    else:
+        os.makedirs(directory, exist_ok=True)
+        os.replace(stream.name, path)
+    return path
+
+# Remove temporary files of uploads that were not stored
+def discard_uploads(uploads):
+    for upload in uploads:
+        upload.close()
+        if os.path.exists(upload.name):
+            os.remove(upload.name)
+
+# Clean up after every request, whether the handler stored its uploads, failed, or the body never finished parsing
+@app.teardown_request
+async def discard_pending_uploads(exc):
+    uploads = g.get('pending_uploads')
+    if uploads:
+        await asyncio.to_thread(discard_uploads, uploads)
+
 # Define the TrainingData model
 class TrainingData(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     question = db.Column(db.String(500), nullable=False)
+    # Copy of question computed by SQLite's lower(), indexed for prefix lookups (never loaded on rows).
+    # lower() only folds ASCII letters, so search_steps uses it for ASCII messages only.
+    question_lc = deferred(db.Column(db.Text, db.Computed('lower(question)', persisted=False), index=True))
     answer = db.Column(db.String(500), nullable=False)
     link = db.Column(db.String(500), nullable=True)
     video = db.Column(db.String(500), nullable=True)
@@ -54,21 +261,227 @@ class TrainingData(db.Model):
     def __repr__(self):
         return f'<TrainingData {self.question}>'
 
-# Initialize the database before the first request
-@app.before_first_request
-def create_tables():
+# FTS5 index over TrainingData.question, kept in sync by triggers (external content table)
+FTS_SCHEMA = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS training_data_fts USING fts5(question, content='training_data', content_rowid='id')",
+    """CREATE TRIGGER IF NOT EXISTS training_data_ai AFTER INSERT ON training_data BEGIN
+        INSERT INTO training_data_fts(rowid, question) VALUES (new.id, new.question);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS training_data_ad AFTER DELETE ON training_data BEGIN
+        INSERT INTO training_data_fts(training_data_fts, rowid, question) VALUES ('delete', old.id, old.question);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS training_data_au AFTER UPDATE ON training_data BEGIN
+        INSERT INTO training_data_fts(training_data_fts, rowid, question) VALUES ('delete', old.id, old.question);
+        INSERT INTO training_data_fts(rowid, question) VALUES (new.id, new.question);
+    END""",
+]
+
+# Trigram FTS5 index over TrainingData.question for substring matches of short messages ("refund?", "price")
+TRIGRAM_SCHEMA = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS training_data_trigram USING fts5(question, content='training_data', content_rowid='id', tokenize='trigram')",
+    """CREATE TRIGGER IF NOT EXISTS training_data_trigram_ai AFTER INSERT ON training_data BEGIN
+        INSERT INTO training_data_trigram(rowid, question) VALUES (new.id, new.question);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS training_data_trigram_ad AFTER DELETE ON training_data BEGIN
+        INSERT INTO training_data_trigram(training_data_trigram, rowid, question) VALUES ('delete', old.id, old.question);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS training_data_trigram_au AFTER UPDATE ON training_data BEGIN
+        INSERT INTO training_data_trigram(training_data_trigram, rowid, question) VALUES ('delete', old.id, old.question);
+        INSERT INTO training_data_trigram(rowid, question) VALUES (new.id, new.question);
+    END""",
+]
+
+# Full-text indexes created at startup, each backfilled when first created
+SEARCH_INDEXES = [
+    ('training_data_fts', FTS_SCHEMA),
+    ('training_data_trigram', TRIGRAM_SCHEMA),
+]
+
+# The trigram index can only answer substring queries of at least three characters
+TRIGRAM_MIN_LENGTH = 3
+
+TRIGRAM_SEARCH_SQL = text(
+    "SELECT t.* FROM training_data t JOIN training_data_trigram g ON t.id = g.rowid "
+    "WHERE training_data_trigram MATCH :q ORDER BY g.rank"
+)
+
+TRIGRAM_ANSWER_SQL = text(
+    "SELECT t.answer FROM training_data t JOIN training_data_trigram g ON t.id = g.rowid "
+    "WHERE training_data_trigram MATCH :q ORDER BY g.rank LIMIT 1"
+)
+
+FTS_SEARCH_SQL = text(
+    "SELECT t.* FROM training_data t JOIN training_data_fts f ON t.id = f.rowid "
+    "WHERE training_data_fts MATCH :q ORDER BY f.rank"
+)
+
+FTS_ANSWER_SQL = text(
+    "SELECT t.answer FROM training_data t JOIN training_data_fts f ON t.id = f.rowid "
+    "WHERE training_data_fts MATCH :q ORDER BY f.rank LIMIT 1"
+)
+
+FTS_TOKEN_RE = re.compile(r'\w+')
+
+# Sorts after any string that starts with a given prefix, so [prefix, prefix + bound) is an index range
+PREFIX_UPPER_BOUND = '\U0010ffff'
+
+# Search statements are built once and reused with bound parameters, so SQLAlchemy compiles each only once
+PREFIX_CLAUSE = (
+    (TrainingData.question_lc >= bindparam('prefix')) & (TrainingData.question_lc < bindparam('prefix_end'))
+)
+LIST_STMT = select(TrainingData)
+
+# Statements per search step (see search_steps), returning every matching row for /view and a single answer for /chatgpt
+SEARCH_STATEMENTS = {
+    'prefix': select(TrainingData).where(PREFIX_CLAUSE),
+    'trigram': select(TrainingData).from_statement(TRIGRAM_SEARCH_SQL),
+    'fts': select(TrainingData).from_statement(FTS_SEARCH_SQL),
+}
+ANSWER_STATEMENTS = {
+    'prefix': select(TrainingData.answer).where(PREFIX_CLAUSE).limit(1),
+    'trigram': TRIGRAM_ANSWER_SQL,
+    'fts': FTS_ANSWER_SQL,
+}
+
+# WAL lets /chatgpt reads proceed while /add and /edit write; the rest keeps hot pages in memory
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.executescript(
+        "PRAGMA journal_mode=WAL;"
+        "PRAGMA synchronous=NORMAL;"
+        "PRAGMA cache_size=-65536;"
+        "PRAGMA mmap_size=268435456;"
+        "PRAGMA temp_store=MEMORY;"
+    )
+    cursor.close()
+
+def create_search_index():
+    with db.engine.begin() as conn:
+        # Databases created before question_lc existed need the generated column and its index added
+        columns = {row[1] for row in conn.execute(text("PRAGMA table_xinfo(training_data)"))}
+        if 'question_lc' not in columns:
+            conn.execute(text("ALTER TABLE training_data ADD COLUMN question_lc TEXT GENERATED ALWAYS AS (lower(question)) VIRTUAL"))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_training_data_question_lc ON training_data (question_lc)"))
+
+        for table, schema in SEARCH_INDEXES:
+            exists = conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = :name"), {'name': table}).first()
+            for statement in schema:
+                conn.execute(text(statement))
+            # Backfill rows that were added before the index existed
+            if not exists:
+                conn.execute(text(f"INSERT INTO {table}({table}) VALUES ('rebuild')"))
+
+# Normalize a message once at route entry (NFKC, trimmed, lowercased); the search helpers expect this form
+def normalize_query(query):
+    return unicodedata.normalize('NFKC', query).strip().lower()
+
+# Turn a free-text message into an FTS5 query: each word quoted, joined by FTS5's implicit AND, so a row
+# only matches when its question contains every word of the message (anything else falls through to GPT)
+def to_fts_query(query):
+    return ' '.join(f'"{token}"' for token in FTS_TOKEN_RE.findall(query))
+
+# Initialize the database and the OpenAI client before serving requests
+@app.before_serving
+async def startup():
+    global client, semantic_cache, vectorizer
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=BLOCKING_IO_WORKERS, thread_name_prefix='blocking-io')
+    )
+    event.listen(db.engine, 'connect', set_sqlite_pragmas)
     db.create_all()
+    create_search_index()
+    # One client per process so its HTTP connection pool (keep-alive, TLS) is reused across requests.
+    # Retries are handled by request_completion, so the client's own retries are disabled.
+    # Without an API key the bot still starts and answers from the training data.
+    api_key = os.environ.get("OPENAI_API_KEY")
+    if api_key:
+        client = openai.AsyncOpenAI(
+            api_key=api_key,
+            max_retries=0,
+            timeout=OPENAI_TIMEOUT,
+            http_client=openai.DefaultAsyncHttpxClient(limits=OPENAI_CONNECTION_LIMITS),
+        )
+    else:
+        logging.warning("OPENAI_API_KEY is not set, answers will only come from the training data")
 
-# Function to search for answers in the database
+    redis_url = os.environ.get("REDIS_URL")
+    if redis_url:
+        # Cosine distance 0.1 means paraphrases with similarity >= 0.90 share a cached answer.
+        # The cache is optional, so an unreachable Redis or a missing model only disables it.
+        try:
+            model = HFTextVectorizer(model="sentence-transformers/all-MiniLM-L6-v2")
+            semantic_cache = SemanticCache(name="answer_cache", redis_url=redis_url, distance_threshold=0.1, ttl=300, vectorizer=model)
+            vectorizer = model
+        except Exception as e:
+            logging.error(f"Semantic cache disabled, could not set it up: {e}")
+            semantic_cache = None
+            vectorizer = None
+
+# Close the OpenAI client's connection pool on shutdown
+@app.after_serving
+async def shutdown():
+    if client is not None:
+        await client.close()
+
+# Bound parameters for PREFIX_CLAUSE
+def prefix_params(prefix):
+    return {'prefix': prefix, 'prefix_end': prefix + PREFIX_UPPER_BOUND}
+
+# Search steps from cheapest to broadest: questions starting with the message (index range), questions
+# containing it (trigram index, the old ILIKE '%q%' semantics), then questions containing all of its words (FTS5).
+# The prefix step is skipped for non-ASCII messages: question_lc keeps "É" uppercase while the message is
+# lowercased by Python, so it could never match; the trigram and FTS5 indexes fold Unicode case themselves.
+def search_steps(query):
+    if query and query.isascii():
+        yield 'prefix', prefix_params(query)
+    if len(query) >= TRIGRAM_MIN_LENGTH:
+        yield 'trigram', {'q': '"' + query.replace('"', '""') + '"'}
+    fts_query = to_fts_query(query)
+    if fts_query:
+        yield 'fts', {'q': fts_query}
+
+# Function to list all training data rows
+def list_training_data():
+    return db.session.scalars(LIST_STMT).all()
+
+# Function to search for training data rows in the database. /view lists every match so operators can find
+# rows to edit or delete, so unlike find_answer it runs all steps and merges their rows, best matches first.
 def search_training_data(query):
-    results = TrainingData.query.filter(TrainingData.question.ilike(f'%{query}%')).all()
-    logging.info(f"Database search results: {results}")
+    results = {}
+    for step, params in search_steps(query):
+        for row in db.session.scalars(SEARCH_STATEMENTS[step], params):
+            results.setdefault(row.id, row)
+    results = list(results.values())
+    logging.info(f"Database search results: {len(results)} rows")
     return results
 
-# Function to generate answers using GPT-3.5-turbo
-def generate_answer(question):
-    try:
-        response = openai.ChatCompletion.create(
+# Function to find the answer to a chat message in the database, selecting only the answer column
+def find_answer(query):
+    answer = None
+    for step, params in search_steps(query):
+        answer = db.session.execute(ANSWER_STATEMENTS[step], params).scalar_one_or_none()
+        if answer is not None:
+            break
+    logging.info(f"Database search result: {answer}")
+    return answer
+
+# Function to look up a previously generated answer for a similar question
+async def check_semantic_cache(question):
+    # Embedding is CPU-bound, keep it off the event loop
+    vector = await asyncio.to_thread(vectorizer.embed, question)
+    hits = await semantic_cache.acheck(vector=vector)
+    return vector, (hits[0]['response'] if hits else None)
+
+# Function to call GPT-3.5-turbo, retrying with randomized exponential backoff on 429s, 5xx and dropped connections
+@retry(
+    wait=wait_random_exponential(min=1, max=30),
+    stop=stop_after_attempt(5),
+    retry=retry_if_exception_type((openai.RateLimitError, openai.InternalServerError, openai.APIConnectionError)),
+    reraise=True,
+)
+async def request_completion(question):
+    async with openai_limiter, openai_semaphore:
+        return await client.chat.completions.create(
             model="gpt-3.5-turbo",
             messages=[
                 {"role": "system", "content": "You are a helpful assistant."},
@@ -77,130 +490,271 @@ def generate_answer(question):
             max_tokens=150,
             temperature=0.7,
         )
-        answer = response.choices[0].message['content'].strip()
-        return answer
+
+# Function to generate answers using GPT-3.5-turbo
+async def generate_answer(question):
+    vector = None
+    if semantic_cache is not None:
+        try:
+            vector, cached_answer = await check_semantic_cache(question)
+            if cached_answer:
+                logging.info(f"Answer found in semantic cache: {cached_answer}")
+                return cached_answer
+        except Exception as e:
+            logging.error(f"Error reading semantic cache: {e}")
+
+    try:
+        if client is None:
+            raise RuntimeError("OPENAI_API_KEY is not set")
+        response = await request_completion(question)
+        answer = response.choices[0].message.content.strip()
     except Exception as e:
         logging.error(f"Error generating answer: {e}")
-        return "I'm sorry, I couldn't process your request."
+        return FALLBACK_ANSWER
+
+    if vector is not None:
+        try:
+            await semantic_cache.astore(prompt=question, response=answer, vector=vector)
+        except Exception as e:
+            logging.error(f"Error writing semantic cache: {e}")
+    return answer
+
+# Build the TwiML reply for a WhatsApp message
+def twiml_response(answer):
+    bot_resp = MessagingResponse()
+    msg = bot_resp.message()
+    msg.body(answer)
+    return str(bot_resp)
+
+# Messages shorter than this, or without any word characters (emoji, punctuation, Twilio retries with an
+# empty Body), get a canned reply without touching the database or OpenAI
+MIN_QUESTION_LENGTH = 2
+EMPTY_QUESTION_RESPONSE = twiml_response("Please send a question.")
 
 # Route to handle incoming chat requests
 @app.route('/chatgpt', methods=['GET', 'POST'])
-def chatgpt():
+async def chatgpt():
     if request.method == 'POST':
-        incoming_que = request.values.get('Body', '').lower()
+        # Twilio always POSTs form-encoded, so read the form directly instead of merging args and form
+        incoming_que = normalize_query((await request.form).get('Body', ''))
         logging.info(f"Received question: {incoming_que}")
 
-        # Search for the answer in the training data
-        results = search_training_data(incoming_que)
-        if results:
-            answer = results[0].answer
-            logging.info(f"Answer found in training data: {answer}")
+        if len(incoming_que) < MIN_QUESTION_LENGTH or not FTS_TOKEN_RE.search(incoming_que):
+            logging.info("Empty or trivial question, sending canned response")
+            return EMPTY_QUESTION_RESPONSE
+
+        answer = answer_cache.get(incoming_que)
+        generation = answer_cache_generation
+        if answer is not None:
+            logging.info(f"Answer found in answer cache: {answer}")
         else:
-            # Generate the answer using GPT-3.5-turbo
-            answer = generate_answer(incoming_que)
-            logging.info(f"Generated answer using GPT-3.5-turbo: {answer}")
+            # Search for the answer in the training data (off the event loop, the DB driver is blocking)
+            answer = await asyncio.to_thread(find_answer, incoming_que)
+            if answer is not None:
+                logging.info(f"Answer found in training data: {answer}")
+            else:
+                # Generate the answer using GPT-3.5-turbo
+                answer = await generate_answer(incoming_que)
+                logging.info(f"Generated answer using GPT-3.5-turbo: {answer}")
+            # A write committed during the lookup may have changed the answer, so don't cache a stale one
+            if answer != FALLBACK_ANSWER and generation == answer_cache_generation:
+                answer_cache[incoming_que] = answer
 
-        bot_resp = MessagingResponse()
-        msg = bot_resp.message()
-        msg.body(answer)
         logging.info(f"Sending response: {answer}")
-        return str(bot_resp)
+        return twiml_response(answer)
     else:
         return "This endpoint is for POST requests from Twilio"
 
 # Route to handle the root URL
 @app.route('/', methods=['GET'])
-def index():
+async def index():
     return "This is a WhatsApp chatbot powered by GPT-3.5-turbo. Use the /chatgpt endpoint to interact with the bot."
 
 # Route to handle adding new training data
 @app.route('/add', methods=['GET', 'POST'])
-def add_training_data():
+async def add_training_data():
     if request.method == 'POST':
         try:
-            question = request.form['question']
-            answer = request.form['answer']
-            link = request.form.get('link')
-            video = request.form.get('video')
+            form, files = await parse_upload_form()
+            question = form['question']
+            answer = form['answer']
+            link = form.get('link')
+            video = form.get('video')
             picture_path = None
             document_path = None
 
-            if 'picture' in request.files:
-                picture = request.files['picture']
+            if 'picture' in files:
+                picture = files['picture']
                 if picture and allowed_file(picture.filename):
-                    picture_filename = secure_filename(picture.filename)
-                    picture.save(os.path.join(app.config['UPLOAD_FOLDER'], picture_filename))
-                    picture_path = os.path.join(app.config['UPLOAD_FOLDER'], picture_filename)
+                    picture_path = await asyncio.to_thread(store_upload, picture)
 
-            if 'document' in request.files:
-                document = request.files['document']
+            if 'document' in files:
+                document = files['document']
                 if document and allowed_file(document.filename):
-                    document_filename = secure_filename(document.filename)
-                    document.save(os.path.join(app.config['UPLOAD_FOLDER'], document_filename))
-                    document_path = os.path.join(app.config['UPLOAD_FOLDER'], document_filename)
+                    document_path = await asyncio.to_thread(store_upload, document)
 
             new_data = TrainingData(question=question, answer=answer, link=link, video=video, picture=picture_path, document=document_path)
             db.session.add(new_data)
-            db.session.commit()
+            await asyncio.to_thread(db.session.commit)
+            invalidate_answer_cache()
             return redirect(url_for('add_training_data'))
+        except HTTPException:
+            raise
         except Exception as e:
             logging.error(f"Error adding training data: {e}")
             return "An error occurred while adding the training data."
-    return render_template('add.html')
+    return await render_template('add.html')
+
 
+# Fields accepted per record by /bulk_add
+BULK_FIELDS = ('question', 'answer', 'link', 'video')
+# Bad lines listed in the 400 response of a rejected import
+MAX_REPORTED_BULK_ERRORS = 20
+
+# Parse a JSONL (one object per line) or CSV (with a header row) body into TrainingData mappings
+def parse_bulk_rows(body, mimetype):
+    if mimetype == 'text/csv':
+        records = parse_csv_records(body)
+    else:
+        records = parse_jsonl_records(body)
+    rows = []
+    errors = []
+    for line_number, record in records:
+        if not isinstance(record, dict):
+            errors.append(f"line {line_number}: not a JSON object")
+            continue
+        line_errors = len(errors)
+        row = {}
+        for field in BULK_FIELDS:
+            value = record.get(field)
+            if isinstance(value, (dict, list)):
+                errors.append(f"line {line_number}: {field} must be a string")
+                value = None
+            # Numbers and booleans are stored as text, like every other column
+            text_value = '' if value is None else str(value).strip()
+            row[field] = text_value or None
+        if not row['question'] and len(errors) == line_errors:
+            errors.append(f"line {line_number}: question is required")
+        rows.append(row)
+    if errors:
+        raise ValueError("Invalid training data: " + "; ".join(errors[:MAX_REPORTED_BULK_ERRORS]))
+    return rows
+
+# (line number, record) for each CSV row after the header
+def parse_csv_records(body):
+    reader = csv.DictReader(io.StringIO(body))
+    try:
+        for record in reader:
+            yield reader.line_num, record
+    except csv.Error as e:
+        raise ValueError(f"Invalid training data: line {reader.line_num}: {e}")
+
+# (line number, decoded value) for each non-blank JSONL line; lines that are not valid JSON decode to None
+def parse_jsonl_records(body):
+    for line_number, line in enumerate(body.splitlines(), start=1):
+        if line.strip():
+            try:
+                yield line_number, json.loads(line)
+            except json.JSONDecodeError:
+                yield line_number, None
+
+# Route to import many training data entries at once, generating missing answers with GPT-3.5-turbo
+@app.route('/bulk_add', methods=['GET', 'POST'])
+async def bulk_add_training_data():
+    if request.method == 'POST':
+        try:
+            rows = parse_bulk_rows(await request.get_data(as_text=True), request.mimetype)
+
+            # Generate missing answers concurrently; request_completion bounds and rate-limits the calls
+            missing = [row for row in rows if not row['answer']]
+            answers = await asyncio.gather(*(generate_answer(row['question']) for row in missing))
+            for row, answer in zip(missing, answers):
+                row['answer'] = answer
+            stored = [row for row in rows if row['answer'] != FALLBACK_ANSWER]
+
+            # One batched INSERT and a single commit for the whole import
+            await asyncio.to_thread(db.session.bulk_insert_mappings, TrainingData, stored)
+            await asyncio.to_thread(db.session.commit)
+            invalidate_answer_cache()
+            logging.info(f"Bulk added {len(stored)} training data entries, skipped {len(rows) - len(stored)}")
+            return f"Added {len(stored)} training data entries, skipped {len(rows) - len(stored)} without an answer."
+        except ValueError as e:
+            logging.error(f"Error bulk adding training data: {e}")
+            return str(e), 400
+        except Exception as e:
+            logging.error(f"Error bulk adding training data: {e}")
+            return "An error occurred while adding the training data."
+    return "This endpoint accepts training data as JSONL or CSV (question, answer, link, video) via POST"
 
 # Route to view and search the training data
 @app.route('/view', methods=['GET', 'POST'])
-def view_training_data():
-    query = request.args.get('query')
+async def view_training_data():
+    query = normalize_query(request.args.get('query', ''))
     if query:
-        data = search_training_data(query)
+        data = await asyncio.to_thread(search_training_data, query)
     else:
-        data = TrainingData.query.all()
-    return render_template('view.html', data=data)
+        data = await asyncio.to_thread(list_training_data)
+    return await render_template('view.html', data=data)
 
 # Route to edit training data
 @app.route('/edit/<int:id>', methods=['GET', 'POST'])
-def edit_training_data(id):
-    data = TrainingData.query.get_or_404(id)
+async def edit_training_data(id):
+    data = await asyncio.to_thread(db.get_or_404, TrainingData, id)
     if request.method == 'POST':
         try:
-            data.question = request.form['question']
-            data.answer = request.form['answer']
-            data.link = request.form.get('link')
-            data.video = request.form.get('video')
-
-            if 'picture' in request.files:
-                picture = request.files['picture']
+            form, files = await parse_upload_form()
+            data.question = form['question']
+            data.answer = form['answer']
+            data.link = form.get('link')
+            data.video = form.get('video')
+
+            if 'picture' in files:
+                picture = files['picture']
                 if picture and allowed_file(picture.filename):
-                    picture_filename = secure_filename(picture.filename)
-                    picture.save(os.path.join(app.config['UPLOAD_FOLDER'], picture_filename))
-                    data.picture = os.path.join(app.config['UPLOAD_FOLDER'], picture_filename)
+                    data.picture = await asyncio.to_thread(store_upload, picture)
 
-            if 'document' in request.files:
-                document = request.files['document']
+            if 'document' in files:
+                document = files['document']
                 if document and allowed_file(document.filename):
-                    document_filename = secure_filename(document.filename)
-                    document.save(os.path.join(app.config['UPLOAD_FOLDER'], document_filename))
-                    data.document = os.path.join(app.config['UPLOAD_FOLDER'], document_filename)
+                    data.document = await asyncio.to_thread(store_upload, document)
 
-            db.session.commit()
+            await asyncio.to_thread(db.session.commit)
+            invalidate_answer_cache()
             return redirect(url_for('view_training_data'))
+        except HTTPException:
+            raise
         except Exception as e:
             logging.error(f"Error updating data: {e}")
             return "An error occurred while updating the data."
 
-    return render_template('edit.html', data=data)
+    return await render_template('edit.html', data=data)
+
+
+# Route to serve an uploaded picture or document of a training data entry
+@app.route('/media/<int:id>/<field>', methods=['GET'])
+async def media(id, field):
+    if field not in MEDIA_FIELDS:
+        abort(404)
+    data = await asyncio.to_thread(db.get_or_404, TrainingData, id)
+    path = getattr(data, field)
+    if not path or not await asyncio.to_thread(os.path.isfile, path):
+        abort(404)
+    if X_ACCEL_REDIRECT_PREFIX:
+        relative_path = os.path.relpath(path, app.config['UPLOAD_FOLDER']).replace(os.sep, '/')
+        mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        return Response('', mimetype=mimetype, headers={'X-Accel-Redirect': f"{X_ACCEL_REDIRECT_PREFIX.rstrip('/')}/{relative_path}"})
+    return await send_file(path)
 
 
 # Route to delete training data
 @app.route('/delete/<int:id>', methods=['POST'])
-def delete_training_data(id):
-    data = TrainingData.query.get_or_404(id)
+async def delete_training_data(id):
+    data = await asyncio.to_thread(db.get_or_404, TrainingData, id)
     db.session.delete(data)
-    db.session.commit()
+    await asyncio.to_thread(db.session.commit)
+    invalidate_answer_cache()
     return redirect(url_for('view_training_data'))
 
-# Run the Flask app
+# Run the Quart app (for production use: hypercorn app:app --bind 0.0.0.0:5000)
 if __name__ == '__main__':
     app.run(host='0.0.0.0', debug=False, port=5000)
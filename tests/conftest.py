@@ -0,0 +1,20 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as chatbot  # noqa: E402
+
+
+@pytest.fixture
+def app():
+    return chatbot.app
+
+
+# Point uploads at an empty temporary directory for the duration of a test
+@pytest.fixture
+def upload_folder(app, tmp_path, monkeypatch):
+    monkeypatch.setitem(app.config, 'UPLOAD_FOLDER', str(tmp_path))
+    return tmp_path
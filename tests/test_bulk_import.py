@@ -0,0 +1,57 @@
+import asyncio
+
+import pytest
+
+from app import MAX_REPORTED_BULK_ERRORS, parse_bulk_rows
+
+
+def test_jsonl_values_are_coerced_to_text():
+    rows = parse_bulk_rows('{"question": 7, "answer": true}\n\n{"question": " Where? ", "link": null}\n', 'application/x-ndjson')
+    assert rows == [
+        {'question': '7', 'answer': 'True', 'link': None, 'video': None},
+        {'question': 'Where?', 'answer': None, 'link': None, 'video': None},
+    ]
+
+
+def test_csv_rows_are_parsed():
+    rows = parse_bulk_rows('question,answer,extra\nHow much?,5 USD,ignored,more\nWhy?\n', 'text/csv')
+    assert rows == [
+        {'question': 'How much?', 'answer': '5 USD', 'link': None, 'video': None},
+        {'question': 'Why?', 'answer': None, 'link': None, 'video': None},
+    ]
+
+
+@pytest.mark.parametrize('body, mimetype, message', [
+    ('{"question": "ok"}\nnot json\n', 'application/x-ndjson', 'line 2: not a JSON object'),
+    ('["question"]\n', 'application/x-ndjson', 'line 1: not a JSON object'),
+    ('{"question": {"text": "nested"}}\n', 'application/x-ndjson', 'line 1: question must be a string'),
+    ('{"question": "ok"}\n{"answer": "no question"}\n', 'application/x-ndjson', 'line 2: question is required'),
+    ('{"question": "   "}\n', 'application/x-ndjson', 'line 1: question is required'),
+    ('question,answer\nok,a\n,no question\n', 'text/csv', 'line 3: question is required'),
+])
+def test_invalid_lines_are_reported_by_number(body, mimetype, message):
+    with pytest.raises(ValueError) as excinfo:
+        parse_bulk_rows(body, mimetype)
+    assert str(excinfo.value) == f'Invalid training data: {message}'
+
+
+def test_nested_question_is_reported_once():
+    with pytest.raises(ValueError) as excinfo:
+        parse_bulk_rows('{"question": [1]}\n', 'application/x-ndjson')
+    assert str(excinfo.value) == 'Invalid training data: line 1: question must be a string'
+
+
+def test_reported_errors_are_capped():
+    with pytest.raises(ValueError) as excinfo:
+        parse_bulk_rows('bad\n' * (MAX_REPORTED_BULK_ERRORS + 5), 'application/x-ndjson')
+    assert str(excinfo.value).count('not a JSON object') == MAX_REPORTED_BULK_ERRORS
+
+
+def test_bulk_add_rejects_malformed_input(app):
+    async def run():
+        response = await app.test_client().post(
+            '/bulk_add', data='{"question": "ok"}\nnot json\n', headers={'Content-Type': 'application/x-ndjson'}
+        )
+        return response.status_code, await response.get_data(as_text=True)
+
+    assert asyncio.run(run()) == (400, 'Invalid training data: line 2: not a JSON object')
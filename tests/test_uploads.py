@@ -0,0 +1,129 @@
+import asyncio
+import hashlib
+import os
+
+import pytest
+from werkzeug.exceptions import BadRequest, RequestEntityTooLarge
+
+from app import MAX_FORM_FIELD_SIZE, MAX_FORM_PARTS, DiscardedUpload, HashingUpload, parse_upload_form
+
+HEADERS = {'Content-Type': 'multipart/form-data; boundary=testboundary'}
+FIELDS = [('question', None, b'What is the price?'), ('answer', None, b'Ten dollars')]
+
+
+# Build a multipart/form-data body from (name, filename, data) parts; filename None makes a plain field
+def multipart_body(parts, close=True):
+    body = b''
+    for name, filename, data in parts:
+        disposition = f'form-data; name="{name}"'
+        if filename is not None:
+            disposition += f'; filename="{filename}"'
+        body += f'--testboundary\r\nContent-Disposition: {disposition}\r\n\r\n'.encode() + data + b'\r\n'
+    if close:
+        body += b'--testboundary--\r\n'
+    return body
+
+
+# Files left in the upload folder, relative to it
+def stored_files(folder):
+    return sorted(
+        os.path.relpath(os.path.join(root, name), folder)
+        for root, _, names in os.walk(folder)
+        for name in names
+    )
+
+
+# Parse a body inside a request context and hand the result to check() before the context (and so the
+# teardown_request cleanup) ends; returns whatever check returns
+def parse(app, body, check=lambda form, files: (form, files)):
+    async def run():
+        async with app.test_request_context('/add', method='POST', headers=HEADERS, data=body):
+            form, files = await parse_upload_form()
+            return check(form, files)
+    return asyncio.run(run())
+
+
+def test_fields_and_allowed_file_are_parsed(app, upload_folder):
+    data = os.urandom(3 << 20)
+
+    def check(form, files):
+        stream = files['document'].stream
+        assert isinstance(stream, HashingUpload)
+        assert stream.sha256.hexdigest() == hashlib.sha256(data).hexdigest()
+        assert os.path.getsize(stream.name) == len(data)
+        return dict(form)
+
+    form = parse(app, multipart_body(FIELDS + [('document', 'brochure.pdf', data)]), check)
+    assert form == {'question': 'What is the price?', 'answer': 'Ten dollars'}
+
+
+def test_empty_file_input_is_discarded(app, upload_folder):
+    def check(form, files):
+        assert isinstance(files['picture'].stream, DiscardedUpload)
+        assert stored_files(upload_folder) == []
+
+    parse(app, multipart_body(FIELDS + [('picture', '', b'')]), check)
+
+
+def test_disallowed_extension_is_discarded(app, upload_folder):
+    def check(form, files):
+        assert isinstance(files['picture'].stream, DiscardedUpload)
+        assert stored_files(upload_folder) == []
+
+    parse(app, multipart_body(FIELDS + [('picture', 'evil.exe', b'MZ')]), check)
+
+
+def test_only_first_part_per_media_field_is_streamed(app, upload_folder):
+    parts = FIELDS + [('picture', 'a.png', b'first'), ('picture', 'b.png', b'second'), ('other', 'c.png', b'other')]
+
+    def check(form, files):
+        streams = [upload.stream for upload in files.getlist('picture')]
+        assert isinstance(streams[0], HashingUpload)
+        assert isinstance(streams[1], DiscardedUpload)
+        assert isinstance(files['other'].stream, DiscardedUpload)
+        assert len(stored_files(upload_folder)) == 1
+
+    parse(app, multipart_body(parts), check)
+
+
+def test_truncated_body_is_rejected(app, upload_folder):
+    body = multipart_body(FIELDS + [('document', 'brochure.pdf', b'%PDF')], close=False)[:-10]
+    with pytest.raises(BadRequest):
+        parse(app, body)
+    assert stored_files(upload_folder) == []
+
+
+def test_oversized_field_is_rejected(app, upload_folder):
+    with pytest.raises(RequestEntityTooLarge):
+        parse(app, multipart_body([('question', None, b'q' * (MAX_FORM_FIELD_SIZE + 1))]))
+
+
+def test_too_many_parts_are_rejected(app, upload_folder):
+    parts = FIELDS + [('picture', 'x.png', b'1')] * MAX_FORM_PARTS
+    with pytest.raises(RequestEntityTooLarge):
+        parse(app, multipart_body(parts))
+    assert stored_files(upload_folder) == []
+
+
+def test_unstored_uploads_are_removed_after_the_request(app, upload_folder):
+    def check(form, files):
+        assert stored_files(upload_folder) != []
+
+    parse(app, multipart_body(FIELDS + [('picture', 'a.png', b'png'), ('document', 'd.pdf', b'pdf')]), check)
+    assert stored_files(upload_folder) == []
+
+
+@pytest.mark.parametrize('parts, close, status', [
+    # A file part followed by a body cut off mid-stream
+    (FIELDS + [('picture', 'a.png', b'png')], False, 400),
+    # Required answer field missing after the file has been streamed
+    ([('question', None, b'Q'), ('picture', 'a.png', b'png')], True, 400),
+    ([('question', None, b'Q' * (MAX_FORM_FIELD_SIZE + 1))], True, 413),
+])
+def test_add_rejects_bad_forms_without_leaving_files(app, upload_folder, parts, close, status):
+    async def run():
+        response = await app.test_client().post('/add', headers=HEADERS, data=multipart_body(parts, close))
+        return response.status_code
+
+    assert asyncio.run(run()) == status
+    assert stored_files(upload_folder) == []